@@ -1,35 +1,135 @@
+import asyncio
+import json
 import os
+import re
+from typing import Optional
+
 from dotenv import load_dotenv
 import openai
 
-from mongo_db import insert_into_mongo_db
-from rate_to_question import rate_to_question
-from utils import connect_to_email, extract_mail_info, load_config, fetch_question
+from mongo_db import get_last_uid, insert_into_mongo_db
+from rate_to_question import batch_grade, rate_many
+from utils import chunked, connect_to_email, extract_mail_info, load_config, fetch_question
 
 load_dotenv()
 
 username = os.getenv("MAIL_TO_CHECK")
 password = os.getenv("APP_PASSWORD")
 mails_file_path = os.getenv("MAILS_FILE_PATH")
-load_dotenv()
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+concurrency = int(os.getenv("GRADING_CONCURRENCY", "10"))
+chunk_size = int(os.getenv("GRADING_CHUNK_SIZE", "20"))
+insert_batch_size = int(os.getenv("INSERT_BATCH_SIZE", "100"))
+use_batch_api = os.getenv("USE_BATCH_API", "0") == "1"
+client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 config = load_config('config.json')
 prompt = config['prompt']
+model = config.get('model', 'gpt-4o-mini')
 
+# Legacy `<میانگین: 7>` marker produced by the plain-text prompt format.
+_GRADE_RE = re.compile(r'<\s*[^:>]+:\s*([0-9]+(?:\.[0-9]+)?)\s*>')
 
 
-if __name__ == "__main__":
-    mails_info = []
+def parse_grade(ai_answer: str) -> Optional[float]:
+    """
+    Extract the grade from the model's JSON response.
+
+    Falls back to the legacy `<...: grade>` marker for responses that are
+    not valid JSON.
+
+    Parameters:
+        ai_answer (str): The model's response.
+
+    Returns:
+        Optional[float]: The extracted grade, or None if the response
+        carries no grade (e.g. the error sentinel from rate_to_question).
+    """
+    try:
+        grade = json.loads(ai_answer).get('grade')
+        return None if grade is None else float(grade)
+    except (json.JSONDecodeError, AttributeError, TypeError, ValueError):
+        pass
+    if match := _GRADE_RE.search(ai_answer):
+        return float(match.group(1))
+    print(f"No grade found in model response: {ai_answer!r}")
+    return None
+
+
+async def grade_chunk(chunk: list, question: str, semaphore: asyncio.Semaphore) -> None:
+    """
+    Grade a chunk of submissions in one request and store the results.
+
+    Parameters:
+        chunk (list): Mail information dictionaries with the submitted code.
+        question (str): The question text.
+        semaphore (asyncio.Semaphore): Caps the number of in-flight API calls.
+    """
+    answers = [(mail_info['mail_id'], mail_info['py_content']) for mail_info in chunk]
+    async with semaphore:
+        results = await rate_many(question, answers, prompt, client, model=model)
+    results_by_id = {}
+    for result in results:
+        result_id = result.get('id') if isinstance(result, dict) else None
+        if result_id is None:
+            print(f"Skipping malformed grading result: {result!r}")
+            continue
+        results_by_id[str(result_id)] = result
+    for mail_info in chunk:
+        result = results_by_id.get(mail_info['mail_id'], {})
+        mail_info['ai_answer'] = str(result.get('feedback', ''))
+        grade = result.get('grade')
+        try:
+            mail_info['grade'] = None if grade is None else float(grade)
+        except (TypeError, ValueError):
+            print(f"No grade found in grading result: {result!r}")
+            mail_info['grade'] = None
+
+
+async def grade_session_mails(session_mails: list, question: str, semaphore: asyncio.Semaphore) -> None:
+    """
+    Grade all mails of the current session, via the Batch API or chunked
+    concurrent requests depending on USE_BATCH_API.
+
+    Parameters:
+        session_mails (list): Mail information dictionaries for the session.
+        question (str): The question text.
+        semaphore (asyncio.Semaphore): Caps the number of in-flight API calls.
+    """
+    if not session_mails:
+        return
+    if use_batch_api:
+        sync_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        answers = await asyncio.to_thread(
+            batch_grade, session_mails, question, prompt, sync_client, model=model
+        )
+        for mail_info in session_mails:
+            ai_answer = answers.get(mail_info['mail_id'], "")
+            mail_info['ai_answer'] = ai_answer
+            mail_info['grade'] = parse_grade(ai_answer)
+    else:
+        chunks = [session_mails[i:i + chunk_size] for i in range(0, len(session_mails), chunk_size)]
+        tasks = [grade_chunk(chunk, question, semaphore) for chunk in chunks]
+        await asyncio.gather(*tasks)
+
+
+async def main() -> None:
     mail = connect_to_email(username, password)
-    mails = extract_mail_info(mail, mails_file_path)
+    mails = extract_mail_info(mail, mails_file_path, last_uid=get_last_uid())
     question, session = fetch_question()
-    for mail_info in mails:
-        if mail_info['mail_subject'] == session:
-            ai_answer = str(rate_to_question(question, mail_info['py_content'], prompt, client))
-            grade = float(ai_answer.split('<')[1].split('>')[0].split(':')[1])
-            mail_info['ai_answer'] = ai_answer
-            mail_info['grade'] = grade
-        else:
-            pass
-        mails_info.append(mail_info)
-    insert_into_mongo_db(mails_info)
\ No newline at end of file
+    semaphore = asyncio.Semaphore(concurrency)
+    if use_batch_api:
+        # One Batch API job for the whole run: per-insert-batch jobs would
+        # each wait out their own completion window, serially.
+        mails_info = list(mails)
+        session_mails = [mail_info for mail_info in mails_info if mail_info['mail_subject'] == session]
+        await grade_session_mails(session_mails, question, semaphore)
+        for batch in chunked(mails_info, insert_batch_size):
+            insert_into_mongo_db(batch)
+    else:
+        for batch in chunked(mails, insert_batch_size):
+            session_mails = [mail_info for mail_info in batch if mail_info['mail_subject'] == session]
+            await grade_session_mails(session_mails, question, semaphore)
+            insert_into_mongo_db(batch)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
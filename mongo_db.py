@@ -1,9 +1,11 @@
+import functools
 import os
 from typing import Any, Dict, List
 
 from dotenv import load_dotenv
 import pymongo
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
 
 load_dotenv()
 
@@ -24,32 +26,105 @@ def create_mongo_db_collection(db_client: MongoClient):
     """
     Create MongoDB
 
+    With MONGO_FAST_INSERT=1 the collection uses write concern w=0
+    (fire-and-forget): inserts return without server acknowledgement,
+    which is much faster but silently drops documents the server
+    rejects. Leave it unset when durability matters.
+
     Parameters:
          db_client (MongoClient)
     Return:
 
     """
     db = db_client["mails_db"]
+    if os.getenv("MONGO_FAST_INSERT", "0") == "1":
+        return db.get_collection("mails_info", write_concern=pymongo.WriteConcern(w=0))
     mails_info_collection = db["mails_info"]
     return mails_info_collection
 
+@functools.lru_cache(maxsize=1)
+def _get_collection():
+    """
+    Return the mails_info collection backed by a single cached MongoClient.
+
+    MongoClient holds its own connection pool and is meant to be created
+    once per process, not once per insert.
+
+    Return:
+        Collection: The cached mails_info collection
+    """
+    db_host = os.getenv("MONGO_DB_HOST", "localhost")
+    db_port = int(os.getenv("MONGO_DB_PORT", "27017"))
+    mongo_db_client = connect_to_mongo_db(db_host=db_host, db_port=db_port)
+    return create_mongo_db_collection(mongo_db_client)
+
+def get_last_uid() -> int:
+    """
+    Return the highest IMAP UID processed so far, 0 when none is recorded.
+
+    Return:
+        int: The stored last_uid
+    """
+    try:
+        state = _get_collection().find_one({"_id": "state"})
+    except Exception as e:
+        print(f"Error reading IMAP state: {e}")
+        return 0
+    return int(state.get("last_uid", 0)) if state else 0
+
+# Set after the first failed insert of a run; later batches carry higher
+# UIDs (mails arrive oldest-first), so advancing past a failure would skip
+# the failed mails on every future run.
+_uid_advance_blocked = False
+
 def insert_into_mongo_db(mails_info: List[Dict[str, Any]]) -> None:
     """
-    Insert Mails information to MongoDB
+    Insert Mails information to MongoDB and advance the stored last_uid
+    so the next run only fetches newer messages.
+
+    last_uid only moves past mails that were actually inserted: after a
+    partial BulkWriteError it stops below the lowest failed UID, and once
+    any insert of the run has failed it stops advancing altogether, so
+    dropped mails are re-fetched next run. With MONGO_FAST_INSERT=1 writes
+    are unacknowledged and failures invisible, so last_uid is never
+    advanced in that mode.
 
     Parameters:
         mails_info (List[Dict[str]]): Dictionary of mail inforamtion
     Return:
 
     """
-    db_host = os.getenv("MONGO_DB_HOST", "localhost")
-    db_port = int(os.getenv("MONGO_DB_PORT", "27017"))
-    mongo_db_client = connect_to_mongo_db(db_host=db_host, db_port=db_port)
-    mongo_db_collection = create_mongo_db_collection(mongo_db_client)
+    global _uid_advance_blocked
+    collection = _get_collection()
+    advance_allowed = not _uid_advance_blocked and collection.write_concern.acknowledged
+    inserted = mails_info
+    failed_uids = []
     try:
-        mongo_db_collection.insert_many(mails_info)
+        collection.insert_many(mails_info, ordered=False)
+    except BulkWriteError as e:
+        print(f"Error inserting documents: {e}")
+        _uid_advance_blocked = True
+        failed_indexes = {error['index'] for error in e.details.get('writeErrors', [])}
+        inserted = [mail_info for i, mail_info in enumerate(mails_info) if i not in failed_indexes]
+        failed_uids = [int(mails_info[i]['mail_id']) for i in failed_indexes
+                       if str(mails_info[i].get('mail_id', '')).isdigit()]
     except Exception as e:
         print(f"Error inserting documents: {e}")
+        _uid_advance_blocked = True
+        return None
+    if not advance_allowed:
+        return None
+    uids = [int(mail_info['mail_id']) for mail_info in inserted
+            if str(mail_info.get('mail_id', '')).isdigit()]
+    if failed_uids:
+        uids = [uid for uid in uids if uid < min(failed_uids)]
+    if uids:
+        try:
+            collection.update_one(
+                {"_id": "state"}, {"$max": {"last_uid": max(uids)}}, upsert=True
+            )
+        except Exception as e:
+            print(f"Error updating IMAP state: {e}")
     return None
 
 
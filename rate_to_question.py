@@ -1,4 +1,37 @@
-def rate_to_question(question: str, answer: str, prompt: str, client) -> str:
+import json
+import os
+import tempfile
+import time
+
+import openai
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+
+from typing import Any, Dict, List, Tuple
+
+RATE_ONE_SCHEMA = 'Return ONLY a JSON object shaped like {"grade": ..., "feedback": "..."}.'
+RATE_MANY_SCHEMA = (
+    'Return ONLY a JSON object with one item per <ID:...> block, shaped like '
+    '{"results": [{"id": "...", "grade": ..., "feedback": "..."}]}.'
+)
+
+
+@retry(
+    wait=wait_random_exponential(min=1, max=60),
+    stop=stop_after_attempt(5),
+    retry=retry_if_exception_type((openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)),
+    reraise=True
+)
+async def _create_chat_completion(client, **kwargs):
+    """
+    Call the chat completions endpoint, retrying transient API errors
+    with exponential backoff. Auth and invalid-request errors are raised
+    immediately.
+    """
+    return await client.chat.completions.create(**kwargs)
+
+
+async def rate_to_question(question: str, answer: str, prompt: str, client,
+                           model: str = "gpt-4o-mini") -> str:
     """
     Use OpenAI chat completion to rate the answer to a question.
 
@@ -6,19 +39,133 @@ def rate_to_question(question: str, answer: str, prompt: str, client) -> str:
         question (str): The question text.
         answer (str): The answer text.
         prompt (str): The prompt text to guide the model.
-        client: The OpenAI client instance.
+        client: The AsyncOpenAI client instance.
+        model (str): Name of the chat model to use.
 
     Returns:
-        str: The model's response.
+        str: The model's JSON response with "grade" and "feedback" keys.
     """
     try:
-        chat_completion = client.chat.completions.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": f"{prompt} {question} {answer}"}],
-            temperature=0.2
+        chat_completion = await _create_chat_completion(
+            client,
+            model=model,
+            messages=[
+                {"role": "system", "content": f"{prompt} {RATE_ONE_SCHEMA}"},
+                {"role": "user", "content": f"QUESTION:\n{question}\n\nANSWER:\n{answer}"}
+            ],
+            temperature=0.2,
+            response_format={"type": "json_object"}
         )
         return chat_completion.choices[0].message.content.strip()
     except Exception as e:
         print(f"Error calling OpenAI API: {e}")
-        return ""
+        return json.dumps({"grade": None, "error": str(e)}, ensure_ascii=False)
+
+
+async def rate_many(question: str, answers: List[Tuple[str, str]], prompt: str, client,
+                    model: str = "gpt-4o-mini") -> List[Dict[str, Any]]:
+    """
+    Rate several answers to the same question in a single chat completion.
+
+    Packing answers per request means the prompt and question tokens are
+    sent once per chunk instead of once per answer.
+
+    Parameters:
+        question (str): The question text.
+        answers (List[Tuple[str, str]]): Pairs of (mail id, answer text).
+        prompt (str): The prompt text to guide the model.
+        client: The AsyncOpenAI client instance.
+        model (str): Name of the chat model to use.
+
+    Returns:
+        List[Dict[str, Any]]: One {"id", "grade", "feedback"} dict per answer.
+    """
+    packed_answers = "\n\n".join(f"<ID:{answer_id}>\n{answer}" for answer_id, answer in answers)
+    try:
+        chat_completion = await _create_chat_completion(
+            client,
+            model=model,
+            messages=[
+                {"role": "system", "content": f"{prompt} {RATE_MANY_SCHEMA}"},
+                {"role": "user", "content": f"QUESTION:\n{question}\n\nANSWERS:\n{packed_answers}"}
+            ],
+            temperature=0.2,
+            response_format={"type": "json_object"}
+        )
+        content = chat_completion.choices[0].message.content.strip()
+    except Exception as e:
+        print(f"Error calling OpenAI API: {e}")
+        return []
+    try:
+        return json.loads(content).get('results', [])
+    except json.JSONDecodeError as e:
+        print(f"Error parsing model response as JSON: {e}")
+        return []
+
+
+def batch_grade(mails_info: List[Dict[str, Any]], question: str, prompt: str, client,
+                model: str = "gpt-4o-mini", poll_interval: int = 60) -> Dict[str, str]:
+    """
+    Grade submissions through the OpenAI Batch API (half cost, 24h window).
+
+    Writes one chat-completion request per mail to a JSONL file, uploads it,
+    polls the batch until it finishes and joins the results back by mail id.
 
+    Parameters:
+        mails_info (List[Dict[str, Any]]): Mail information dictionaries with the submitted code.
+        question (str): The question text.
+        prompt (str): The prompt text to guide the model.
+        client: The (synchronous) OpenAI client instance.
+        model (str): Name of the chat model to use.
+        poll_interval (int): Seconds to wait between batch status polls.
+
+    Returns:
+        Dict[str, str]: Mapping of mail_id to the model's response.
+    """
+    if not mails_info:
+        return {}
+    with tempfile.NamedTemporaryFile("w", suffix=".jsonl", encoding="utf-8", delete=False) as requests_file:
+        requests_file_path = requests_file.name
+        for mail_info in mails_info:
+            request = {
+                "custom_id": mail_info['mail_id'],
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": model,
+                    "messages": [
+                        {"role": "system", "content": f"{prompt} {RATE_ONE_SCHEMA}"},
+                        {"role": "user", "content": f"QUESTION:\n{question}\n\nANSWER:\n{mail_info['py_content']}"}
+                    ],
+                    "temperature": 0.2,
+                    "response_format": {"type": "json_object"}
+                }
+            }
+            requests_file.write(json.dumps(request, ensure_ascii=False) + "\n")
+    try:
+        with open(requests_file_path, "rb") as requests_file:
+            input_file = client.files.create(file=requests_file, purpose="batch")
+    finally:
+        os.unlink(requests_file_path)
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(poll_interval)
+        batch = client.batches.retrieve(batch.id)
+    if batch.status != "completed":
+        print(f"Batch {batch.id} ended with status {batch.status}")
+        return {}
+    output = client.files.content(batch.output_file_id)
+    answers = {}
+    for line in output.text.splitlines():
+        result = json.loads(line)
+        response = result.get('response') or {}
+        if response.get('status_code') != 200:
+            print(f"Batch request {result.get('custom_id')} failed: {result.get('error')}")
+            continue
+        content = response['body']['choices'][0]['message']['content']
+        answers[result['custom_id']] = content.strip()
+    return answers
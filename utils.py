@@ -2,18 +2,42 @@ import email
 from email.header import decode_header
 from email.utils import parseaddr, parsedate_to_datetime
 
+import codecs
+import csv
+import functools
 import imaplib
 from imaplib import IMAP4_SSL
+import itertools
 import json
 import os
+import re
+import sqlite3
 
 import jdatetime
-import openpyxl
-import pandas as pd
 
 from mailbox import Message
 
-from typing import Any, Dict, Generator, List, Tuple
+from typing import Any, Dict, Generator, Iterable, List, Set, Tuple
+
+# Cap per .py attachment; anything longer would be truncated by the
+# grading prompt anyway.
+MAX_PY_BYTES = 256 * 1024
+
+
+def chunked(iterable: Iterable, size: int) -> Generator[List, None, None]:
+    """
+    Yield successive lists of at most `size` items from an iterable.
+
+    Parameters:
+        iterable (Iterable): Source of items.
+        size (int): Maximum number of items per chunk.
+
+    Yields:
+        List: The next chunk of items.
+    """
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
 
 
 def connect_to_email(mail_addr: str, mail_passwd: str) -> IMAP4_SSL:
@@ -31,87 +55,148 @@ def connect_to_email(mail_addr: str, mail_passwd: str) -> IMAP4_SSL:
     mail.login(mail_addr, mail_passwd)
     return mail
 
-def fetch_email_addresses(emails_file_path: str) -> List[str]:
+def fetch_email_addresses(emails_file_path: str) -> Set[str]:
     """
-    Reads a CSV file and extracts a list of email addresses.
+    Reads a CSV file and extracts a set of lowercased email addresses.
 
     Parameters:
         emails_file_path (str): Path to the CSV file containing email addresses.
 
     Returns:
-        List[str]: A list of email addresses from the 'email_address' column.
+        Set[str]: Lowercased email addresses from the 'email_address' column.
 
     Raises:
         ValueError: If the 'email_address' column is missing.
     """
-    email_addresses_df = pd.read_csv(emails_file_path)
-    if 'email_address' not in email_addresses_df.columns:
-        raise ValueError("CSV file must contain an 'email_address' column.")
-    return list(email_addresses_df['email_address'])
+    with open(emails_file_path, newline="", encoding="utf-8") as emails_file:
+        email_addresses = csv.DictReader(emails_file)
+        if 'email_address' not in (email_addresses.fieldnames or []):
+            raise ValueError("CSV file must contain an 'email_address' column.")
+        return {row['email_address'].strip().lower() for row in email_addresses}
+
+def _decode_header(header: str) -> str:
+    """
+    Decode an RFC 2047 header into a plain string.
+
+    Joins every encoded-word chunk, unlike taking only the first element
+    of decode_header, which silently truncates multi-chunk subjects.
+
+    Parameters:
+        header (str): Raw header value, possibly None.
+
+    Returns:
+        str: The fully decoded header.
+    """
+    return "".join(
+        part.decode(encoding or "utf-8", errors="ignore") if isinstance(part, bytes) else part
+        for part, encoding in decode_header(header or "")
+    )
+
+
+_UID_RE = re.compile(rb'UID (\d+)')
+
+
+def _iter_fetch_parts(fetch_data: list) -> Generator[Tuple[bytes, bytes], None, None]:
+    """
+    Iterate over the message parts of a (possibly batched) UID FETCH response.
+
+    Parameters:
+        fetch_data (list): Raw response data from IMAP4_SSL.uid('FETCH', ...)
+
+    Yields:
+        Tuple[bytes, bytes]: Pairs of (message UID, raw message bytes)
+    """
+    for response_part in fetch_data:
+        if isinstance(response_part, tuple):
+            match = _UID_RE.search(response_part[0])
+            mail_uid = match.group(1) if match else response_part[0].split()[0]
+            yield mail_uid, response_part[1]
+
 
-def get_filtered_emails(mail: IMAP4_SSL, mails_file_path: str) -> Generator[Tuple[str, Message], None, None]:
+def get_filtered_emails(mail: IMAP4_SSL, mails_file_path: str,
+                        last_uid: int = 0) -> Generator[Tuple[bytes, Message], None, None]:
     """
     Generator that yields full email message objects (email.message.Message)
     for emails from allowed addresses.
 
+    Only messages with UID above `last_uid` are considered, so reruns fetch
+    new mail instead of the whole inbox. Messages are yielded oldest-first,
+    so the last_uid checkpoint can advance batch by batch without jumping
+    past unprocessed mail. Uses two batched FETCH round trips
+    instead of one per message: first a cheap header-fields fetch for all ids
+    to filter out foreign senders and replies/forwards, then a single
+    full-body fetch for the survivors. BODY.PEEK avoids marking messages as
+    seen.
+
     Parameters:
         mail (IMAP4_SSL): Authenticated IMAP connection
         mails_file_path (str): Path to emails file
+        last_uid (int): Highest UID already processed; fetch starts after it
     Yields:
         Message: Full parsed email message object
     """
     mail.select("inbox")
-    status, messages = mail.search(None, 'ALL')
+    status, messages = mail.uid('SEARCH', None, f'UID {last_uid + 1}:*')
     if status != 'OK':
         return
-    mail_ids = messages[0].split()
+    # A `n:*` range always matches the newest message, even when its UID
+    # is below n, so re-check the bound.
+    mail_uids = [mail_uid for mail_uid in messages[0].split() if int(mail_uid) > last_uid]
+    if not mail_uids:
+        return
     emails = fetch_email_addresses(mails_file_path)
-    for mail_id in reversed(mail_ids):
-        status, mail_content = mail.fetch(mail_id, "(RFC822)")
-        if status != 'OK':
+    status, header_data = mail.uid(
+        'FETCH',
+        b','.join(mail_uids).decode(),
+        "(BODY.PEEK[HEADER.FIELDS (FROM IN-REPLY-TO REFERENCES)])"
+    )
+    if status != 'OK':
+        return
+    keeper_uids = []
+    for mail_uid, raw_header in _iter_fetch_parts(header_data):
+        header = email.message_from_bytes(raw_header)
+        if header.get('In-Reply-To') or header.get('References'):
             continue
-        for response_part in mail_content:
-            if isinstance(response_part, tuple):
-                mail_body = email.message_from_bytes(response_part[1])
-                from_ = mail_body.get("From", "")
-                if "<" in from_ and ">" in from_:
-                    sender_email = from_.split("<")[1].split(">")[0]
-                else:
-                    sender_email = from_
-                if sender_email.strip() in emails:
-                    yield mail_id, mail_body
+        sender_email = parseaddr(header.get("From", ""))[1]
+        if sender_email.strip().lower() in emails:
+            keeper_uids.append(mail_uid)
+    if not keeper_uids:
+        return
+    status, body_data = mail.uid('FETCH', b','.join(keeper_uids).decode(), "(BODY.PEEK[])")
+    if status != 'OK':
+        return
+    mail_bodies = {mail_uid: email.message_from_bytes(raw_body) for mail_uid, raw_body in _iter_fetch_parts(body_data)}
+    for mail_uid in keeper_uids:
+        if mail_uid in mail_bodies:
+            yield mail_uid, mail_bodies[mail_uid]
 
 
-def extract_mail_info(mail: IMAP4_SSL, mails_file_path: str) -> Generator[Dict[str, Any], None, None]:
+def extract_mail_info(mail: IMAP4_SSL, mails_file_path: str,
+                      last_uid: int = 0) -> Generator[Dict[str, Any], None, None]:
     """
     Extracts metadata from filtered emails that are not replies or forwards.
 
     Parameters:
         mail (IMAP4_SSL): Authenticated IMAP connection to an email inbox
         mails_file_path (str): Path to the CSV file containing whitelisted sender email addresses
+        last_uid (int): Highest UID already processed; fetch starts after it
 
     Yields:
         dict: A dictionary containing email metadata such as sender, subject, date, time, etc.
     """
-    mails = get_filtered_emails(mail, mails_file_path)
+    mails = get_filtered_emails(mail, mails_file_path, last_uid=last_uid)
     for mail_id, mail_body in mails:
-        if mail_body.get('In-Reply-To') or mail_body.get('References'):
-            continue
-        py_content = get_all_mail_py_attached_content(mail_body)
-        py_files_num = count_py_attachments(mail_body)
+        py_files_num, py_content = extract_py_attachments(mail_body)
         name, email_addr = parseaddr(mail_body.get('From', ''))
         try:
-            email_date = parsedate_to_datetime(mail_body.get('Date', '')).date()
-            email_time = parsedate_to_datetime(mail_body.get('Date', '')).time()
+            email_datetime = parsedate_to_datetime(mail_body.get('Date', ''))
+            email_date, email_time = email_datetime.date(), email_datetime.time()
         except Exception as e:
             print(e)
             email_date, email_time = "", ""
-        subject_raw = mail_body.get("Subject", "")
-        subject, encoding = decode_header(subject_raw)[0]
-        if isinstance(subject, bytes):
-            subject = subject.decode(encoding or "utf-8", errors="ignore")
+        subject = _decode_header(mail_body.get("Subject", ""))
         mail_info = {
-            'mail_id': str(mail_id),
+            'mail_id': mail_id.decode(),
             'mail_sender': name,
             'mail_address': email_addr,
             'mail_time': email_time.strftime('%H:%M:%S'),
@@ -123,9 +208,13 @@ def extract_mail_info(mail: IMAP4_SSL, mails_file_path: str) -> Generator[Dict[s
         yield mail_info
 
 
-def add_mail_info_to_excel(email_info: Dict[str, Any]) -> None:
+def add_mail_info_record(email_info: Dict[str, Any]) -> None:
     """
-    Adds a new email record to an Excel file, avoiding duplicates by mail_id.
+    Appends a new email record to a CSV file, avoiding duplicates by mail_id.
+
+    Seen mail ids are tracked in a small SQLite index next to the CSV, so a
+    duplicate check costs one indexed lookup instead of re-reading and
+    re-writing the whole file per record.
 
     Parameters:
         email_info (Dict): Dictionary containing email metadata
@@ -133,78 +222,55 @@ def add_mail_info_to_excel(email_info: Dict[str, Any]) -> None:
     mails_info_file_path = os.getenv("MAILS_INFO_FILE_PATH")
     if not mails_info_file_path:
         raise EnvironmentError("MAILS_INFO_FILE_PATH not found in environment variables.")
-    if not os.path.exists(mails_info_file_path):
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        headers = list(email_info.keys())
-        ws.append(headers)
-    else:
-        wb = openpyxl.load_workbook(mails_info_file_path)
-        ws = wb.active
-        headers = [cell.value for cell in ws[1]]
-        if 'mail_id' in headers:
-            mail_id_column = headers.index('mail_id')
-            existing_ids = [row[mail_id_column] for row in ws.iter_rows(min_row=2, values_only=True)]
-            if email_info['mail_id'] in existing_ids:
-                wb.close()
-                return
-        else:
-            raise ValueError("'mail_id' column not found in Excel file.")
-    row_data = [email_info.get(header, "") for header in headers]
-    ws.append(row_data)
-    wb.save(mails_info_file_path)
-    wb.close()
-
-
-def count_py_attachments(mail_body: email.message.Message) -> int:
-    """
-    Counts how many attached files with `.py` extension an email has.
-
-    Parameters:
-        mail_body (Message): Parsed email message
-
-    Returns:
-        int: Number of `.py` attachments
+    index_path = f"{mails_info_file_path}.ids.sqlite"
+    with sqlite3.connect(index_path) as connection:
+        connection.execute("CREATE TABLE IF NOT EXISTS mail_ids (mail_id TEXT PRIMARY KEY)")
+        cursor = connection.execute(
+            "INSERT OR IGNORE INTO mail_ids VALUES (?)", (email_info['mail_id'],)
+        )
+        if cursor.rowcount == 0:
+            return
+    write_header = not os.path.exists(mails_info_file_path)
+    with open(mails_info_file_path, "a", newline="", encoding="utf-8") as info_file:
+        writer = csv.writer(info_file)
+        if write_header:
+            writer.writerow(list(email_info.keys()))
+        writer.writerow(list(email_info.values()))
+
+
+def extract_py_attachments(mail_body: email.message.Message) -> Tuple[int, str]:
     """
-    count = 0
-    for part in mail_body.walk():
-        content_disposition = part.get("Content-Disposition", "")
-        if "attachment" in content_disposition.lower():
-            filename = part.get_filename()
-            if filename and filename.lower().endswith('.py'):
-                count += 1
-    return count
+    Counts and concatenates the contents of all `.py` attachments in an email
+    in a single walk over the MIME tree.
 
-def get_all_mail_py_attached_content(mail_body: email.message.Message) -> str:
-    """
-    Extracts and concatenates the contents of all `.py` attachments in an email.
+    Each attachment is truncated to MAX_PY_BYTES, so one oversized
+    submission cannot blow up memory or the prompt size.
 
     Parameters:
         mail_body (Message): Parsed email message
 
     Returns:
-        str: Combined string of all `.py` file contents
+        Tuple[int, str]: Number of `.py` attachments and their combined contents
     """
+    count = 0
     contents = []
-
     for part in mail_body.walk():
         content_disposition = part.get("Content-Disposition", "")
         if "attachment" in content_disposition.lower():
             filename = part.get_filename()
             if filename and filename.lower().endswith('.py'):
-                file_data = part.get_payload(decode=True)
-                try:
-                    content = file_data.decode('utf-8')
-                except UnicodeDecodeError:
-                    content = file_data.decode('latin1')  # fallback
+                count += 1
+                file_data = part.get_payload(decode=True)[:MAX_PY_BYTES]
+                content = codecs.decode(file_data, 'utf-8', errors='replace')
                 contents.append(f"# === File: {filename} ===\n{content.strip()}")
-
-    return "\n\n".join(contents)
+    return count, "\n\n".join(contents)
 
 
+@functools.lru_cache(maxsize=1)
 def load_config(config_path: str = "config.json") -> dict:
     """
-    Load config file from a JSON path.
+    Load config file from a JSON path. The result is cached, so repeated
+    calls do not re-read the file.
 
     Parameters:
         config_path (str): Path of config file.
@@ -218,15 +284,17 @@ def load_config(config_path: str = "config.json") -> dict:
         return json.load(config_file)
 
 
+@functools.lru_cache(maxsize=1)
 def fetch_question() -> Tuple[Any, Any]:
     """
     Reads a CSV file specified by the environment variable 'QUESTION_FILE_PATH',
     and returns the first row's values from the 'question' and 'session' columns.
+    The result is cached, so repeated calls do not re-read the file.
 
     Raises:
         ValueError: If the environment variable 'QUESTION_FILE_PATH' is not set.
         KeyError: If 'question' or 'session' columns are missing in the CSV file.
-        pd.errors.EmptyDataError: If the CSV file is empty.
+        StopIteration: If the CSV file has no data rows.
 
     Returns:
         Tuple[Any, Any]: A tuple containing the first 'question' and 'session' values.
@@ -235,12 +303,10 @@ def fetch_question() -> Tuple[Any, Any]:
     if question_file_path is None:
         raise ValueError("Environment variable 'QUESTION_FILE_PATH' is not set.")
 
-    questions = pd.read_csv(question_file_path)
-
-    if 'question' not in questions.columns or 'session' not in questions.columns:
-        raise KeyError("Columns 'question' or 'session' not found in the CSV file.")
-
-    question = questions['question'].iloc[0]
-    session = questions['session'].iloc[0]
+    with open(question_file_path, newline="", encoding="utf-8") as question_file:
+        questions = csv.DictReader(question_file)
+        if 'question' not in (questions.fieldnames or []) or 'session' not in (questions.fieldnames or []):
+            raise KeyError("Columns 'question' or 'session' not found in the CSV file.")
+        first_row = next(questions)
 
-    return question, session
+    return first_row['question'], first_row['session']